@@ -6,27 +6,64 @@ Key features:
 - Auto-detects EEG, ECG (X1/X2), and CM channels.
 - Keeps EEG (µV) readable by converting ECG (mV) -> µV and placing ECG on a secondary y-axis.
 - CM plotted on a third overlaid axis (can be hidden with --no-cm).
-- Built-in pan/zoom + range slider; legend click to toggle channels.
+- Built-in pan/zoom + range slider (slider dropped above RANGESLIDER_MAX_SAMPLES rows); legend click to toggle channels.
 - Optional per-trace normalization (z-score-like min-max to [-1, 1] per channel) via --normalize.
 - Optional downsampling (integer stride) for performance on very large files.
+- Optional MinMaxLTTB downsampling (--lttb-points) that keeps spikes/extrema visible.
 - Saves interactive HTML if --html-out is specified (recommended for submissions).
+- If plotly-resampler is installed, traces keep full resolution in Python and only an
+  aggregated view (~2k points per trace) is sent to the browser, re-computed on zoom/pan with --dash.
 
 """
 
 import argparse
+import gzip
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.colors as pc
 
+# optional: dynamic view-based downsampling (pip install plotly-resampler)
+try:
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
+
+# optional: extrema-preserving downsampling for --lttb-points (pip install tsdownsample)
+try:
+    from tsdownsample import MinMaxLTTBDownsampler
+except ImportError:
+    MinMaxLTTBDownsampler = None
+
+# optional: compiled normalization kernel (pip install numba)
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 EEG_COLORS = pc.qualitative.Set3
 ECG_COLORS = ['#FF6B6B', '#4ECDC4'] 
 CM_COLOR = '#9B59B6' 
 
+# bump when parsing rules change (ignored columns, dtypes, ...) so old Feather caches are not reused
+CACHE_VERSION = 1
+
+# rows per chunk when --downsample strides through the CSV
+CSV_CHUNK_ROWS = 1_000_000
+
+# points per trace sent to the browser when plotly-resampler is available
+RESAMPLER_N_SHOWN = 2000
+
+# the range slider re-renders every trace as an overview; above this many rows it is left out
+RANGESLIDER_MAX_SAMPLES = 200_000
+
 # columns for EEG
 EEG_CANDIDATES = [
     "Fz", "Cz", "P3", "C3", "F3", "F4", "C4", "P4",
@@ -35,9 +72,11 @@ EEG_CANDIDATES = [
 ]
 
 # columns to be ignored
-IGNORE_EXACT = set([
+IGNORE_EXACT = frozenset({
     "Trigger", "Time_Offset", "ADC_Status", "ADC_Sequence", "Event", "Comments"
-])
+})
+# columns starting with X3 are ignored too
+_X3_PREFIXES = ("X3:", "x3:")
 
 # This function is to set up command line options so user could customize how script runs
 def parse_args() -> argparse.Namespace:
@@ -50,33 +89,121 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--downsample", type=int, default=1,
                     help="Integer stride to downsample rows for speed (default: 1 = no downsample)."
                     )
+    ap.add_argument("--lttb-points", type=int, default=None,
+                    help="MinMaxLTTB-downsample each plotted channel to ~N points, keeping spikes "
+                         "(requires tsdownsample; default: off)."
+                    )
     ap.add_argument("--no-ecg", action="store_true", help="Do not plot ECG channels (X1/X2)."
                     )
     ap.add_argument("--no-cm", action="store_true", help="Do not plot CM channel."
                     )
+    ap.add_argument("--dash", action="store_true",
+                    help="Serve the plot as a local Dash app that re-aggregates on zoom/pan "
+                         "(requires plotly-resampler; blocks until interrupted)."
+                    )
     ap.add_argument("--normalize", action="store_true",
                     help="Per-trace min-max normalization to [-1, 1] (EEG, ECG, CM separately)."
                     )
-    return ap.parse_args()
+    args = ap.parse_args()
+    # MinMaxLTTB needs at least 3 output points (tsdownsample panics below that)
+    if args.lttb_points is not None and args.lttb_points < 3:
+        ap.error("--lttb-points must be at least 3")
+    return args
+
+
+# Number of leading metadata lines ('#') so parsers without comment= support can skip them.
+def count_metadata_lines(csv_path: Path) -> int:
+    n = 0
+    with open(csv_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            n += 1
+    return n
+
+
+# Header-only read; ignored columns are left out of the parse entirely.
+def pick_usecols(csv_path: Path) -> List[str]:
+    header_cols = pd.read_csv(csv_path, comment="#", nrows=0).columns
+    return header_cols[~ignored_columns_mask(header_cols)].tolist()
+
+
+# Every column parsed as numbers (a comment or stray text turns a channel into strings).
+def all_numeric(df: pd.DataFrame) -> bool:
+    return all(pd.api.types.is_numeric_dtype(t) for t in df.dtypes)
+
+
+def read_csv(csv_path: Path, downsample: int = 1) -> pd.DataFrame:
+    usecols = pick_usecols(csv_path)
+    if downsample > 1:
+        # read in chunks (C engine; pyarrow has no chunksize) and keep every Nth data row, counted
+        # across chunks, so peak memory is one chunk plus the strided rows
+        parts, seen = [], 0
+        for chunk in pd.read_csv(csv_path, comment="#", usecols=usecols, chunksize=CSV_CHUNK_ROWS):
+            parts.append(chunk.iloc[(-seen) % downsample::downsample])
+            seen += len(chunk)
+        if not parts:  # header-only CSV
+            return pd.read_csv(csv_path, comment="#", usecols=usecols, nrows=0)
+        return pd.concat(parts, ignore_index=True)
+    n_meta = count_metadata_lines(csv_path)
+    # pyarrow engine parses multithreaded; it has no comment= so point header= past the metadata
+    # lines (skiprows= is not applied before the header there)
+    try:
+        df = pd.read_csv(csv_path, header=n_meta, usecols=usecols, engine="pyarrow")
+        # inline '# ...' comments come back as string columns there; re-read those files below
+        if all_numeric(df):
+            return df
+    except (ImportError, ValueError, KeyError):
+        pass  # pyarrow missing or its parser failed (ArrowInvalid is a ValueError, ArrowKeyError a KeyError)
+    # comment="#" will ignore metadata lines
+    return pd.read_csv(csv_path, comment="#", usecols=usecols)
 
 
 def load_data(csv_path: str, downsample: int) -> pd.DataFrame:
-    # comment="#" will ignore metadata lines
+    csv_path = Path(csv_path)
+    downsample = max(downsample or 1, 1)
+    # parsed result is cached next to the CSV per stride (Feather); reused while newer than the CSV
+    cache = csv_path.with_suffix(f".ds{downsample}.v{CACHE_VERSION}.feather")
+    if cache.exists() and cache.stat().st_mtime >= csv_path.stat().st_mtime:
+        try:
+            return pd.read_feather(cache)
+        except Exception:
+            pass  # unreadable cache, parse the CSV again
+
     try:
-        df = pd.read_csv(csv_path, comment="#")
+        df = read_csv(csv_path, downsample)
     except Exception as e:
         print(f"Failed to read CSV: {e}", file=sys.stderr)
         raise
 
-    if downsample and downsample > 1:
-        df = df.iloc[::downsample, :].reset_index(drop=True)
-
     # validation of time
     if "Time" not in df.columns:
         raise ValueError("CSV must include a 'Time' column in seconds.")
+
+    # float32 is lossless for (at most 24-bit) EEG samples and halves every downstream pass.
+    # Time stays float64: float32 steps reach ~2 ms after 4.5 h, too coarse for 300 Hz+ timestamps.
+    float_cols = df.select_dtypes(include=["float64"]).columns.drop("Time", errors="ignore")
+    df[float_cols] = df[float_cols].astype(np.float32, copy=False)
+
+    # only cache frames whose channels all parsed as numbers, so a bad parse is not persisted
+    if all_numeric(df):
+        try:
+            df.to_feather(cache)
+        except (ImportError, OSError, ValueError):
+            pass  # pyarrow missing or read-only filesystem
     return df
 
 
+# MinMaxLTTB per channel; rows picked for any channel are kept, so extrema survive downsampling.
+def lttb_downsample(df: pd.DataFrame, channels: List[str], n_out: int) -> pd.DataFrame:
+    if len(df) <= n_out:
+        return df
+    x = df["Time"].to_numpy()
+    ds = MinMaxLTTBDownsampler()
+    idx = np.unique(np.concatenate([ds.downsample(x, df[ch].to_numpy(), n_out=n_out) for ch in channels]))
+    return df.iloc[idx].reset_index(drop=True)
+
+
 def detect_channels(df: pd.DataFrame, include_ecg: bool, include_cm: bool) -> Tuple[List[str], List[str], str]:
     # EEG channels are among EEG_CANDIDATES and present in df
     eeg_channels = [c for c in EEG_CANDIDATES if c in df.columns]
@@ -95,26 +222,83 @@ def detect_channels(df: pd.DataFrame, include_ecg: bool, include_cm: bool) -> Tu
 
     return eeg_channels, ecg_channels, cm_channel
 
-# Check if column should be ignored during plotting.
-def is_ignored_column(col: str) -> bool:
-    if col in IGNORE_EXACT:
-        return True
-    # ignoring starting with X3
-    if col.startswith("X3:") or col.lower().startswith("x3:"):
-        return True
-    return False
-
-# Normalize series to [-1, 1] range with improved handling of edge cases.
-def minmax_normalize(series: pd.Series) -> pd.Series:
-    s_min = series.min()
-    s_max = series.max()
-    if pd.isna(s_min) or pd.isna(s_max) or s_max == s_min:
-        return series * 0.0
-    return 2.0 * (series - s_min) / (s_max - s_min) - 1.0
+# Check which columns should be ignored during plotting, over a whole header at once
+# (string compares run in NumPy, not per-column calls).
+def ignored_columns_mask(cols) -> np.ndarray:
+    cols = np.asarray(cols, dtype=str)
+    ignored = np.isin(cols, list(IGNORE_EXACT))
+    for prefix in _X3_PREFIXES:
+        ignored |= np.char.startswith(cols, prefix)
+    return ignored
+
+# Numba kernel: per-column min/max reduction fused with the affine transform, columns in parallel.
+# NaNs are skipped in the reduction (comparisons with NaN are false), like np.nanmin/np.nanmax;
+# no fastmath, which would let the compiler assume NaNs never occur.
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _minmax_cols(x, out):
+        n, k = x.shape
+        for j in prange(k):
+            mn = np.inf
+            mx = -np.inf
+            for i in range(n):
+                v = x[i, j]
+                if v < mn:
+                    mn = v
+                if v > mx:
+                    mx = v
+            if not mx > mn:  # constant (or all-NaN) column
+                for i in range(n):
+                    out[i, j] = 0.0
+            else:
+                inv = 2.0 / (mx - mn)
+                for i in range(n):
+                    out[i, j] = (x[i, j] - mn) * inv - 1.0
+else:
+    _minmax_cols = None
+
+# Normalize one column to [-1, 1] with NumPy, written into out (nanmin/nanmax release the GIL).
+def _minmax_col_np(x: np.ndarray, out: np.ndarray) -> None:
+    if x.size == 0:  # header-only CSV
+        return
+    mn = np.nanmin(x)
+    mx = np.nanmax(x)
+    if not mx > mn:  # constant (or all-NaN) column
+        out[:] = 0.0
+        return
+    np.subtract(x, mn, out=out)
+    out *= 2.0 / (mx - mn)
+    out -= 1.0
+
+# Normalize every column of a 2-D array to [-1, 1], skipping NaNs (constant columns -> 0).
+# out may be mat itself to normalize in place.
+def minmax_normalize_cols(mat: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        out = np.empty_like(mat)
+    if _minmax_cols is not None and mat.shape[0] > 0:
+        _minmax_cols(mat, out)
+        return out
+    # without Numba, columns are independent: normalize them on a thread pool
+    n_cols = mat.shape[1]
+    with ThreadPoolExecutor(max_workers=min(n_cols, os.cpu_count() or 1) or 1) as ex:
+        list(ex.map(lambda j: _minmax_col_np(mat[:, j], out[:, j]), range(n_cols)))
+    return out
+
+
+# Add a line trace; with plotly-resampler the full series stays in Python (hf_x/hf_y).
+# x and y go in as ndarrays (y as float32) so Plotly emits them as typed arrays, not JSON number lists.
+def add_line(fig, x: np.ndarray, y, trace, **where) -> None:
+    y = np.asarray(y, dtype=np.float32)
+    if FigureResampler is not None and isinstance(fig, FigureResampler):
+        fig.add_trace(trace, hf_x=x, hf_y=y, **where)
+    else:
+        trace.update(x=x, y=y)
+        fig.add_trace(trace, **where)
 
 
 def build_figure(df, eeg_channels, ecg_channels, cm_channel, normalize):
-    time = df["Time"]
+    # one float64 array shared by every trace (no per-trace Series); float32 is too coarse for long recordings
+    time = df["Time"].to_numpy(np.float64)
 
     # Top row: EEG+ECG with a secondary y-axis; Bottom row: CM
     fig = make_subplots(
@@ -127,43 +311,54 @@ def build_figure(df, eeg_channels, ecg_channels, cm_channel, normalize):
         ],
         vertical_spacing=0.08,
     )
+    if FigureResampler is not None:
+        fig = FigureResampler(fig, default_n_shown_samples=RESAMPLER_N_SHOWN)
+
+    # Pull each channel group out of the frame once; traces take column views.
+    # ECG (mV) -> µV for the whole block. With --normalize each group is normalized in place
+    # with a single axis-0 reduction instead of one pandas pass per channel.
+    eeg_mat = df[eeg_channels].to_numpy(np.float32, copy=normalize) if eeg_channels else None
+    ecg_mat = None
+    if ecg_channels:
+        ecg_mat = df[ecg_channels].to_numpy(np.float32, copy=True)
+        ecg_mat *= 1000.0
+    cm_mat = df[[cm_channel]].to_numpy(np.float32, copy=normalize) if cm_channel is not None else None
+    if normalize:
+        for mat in (eeg_mat, ecg_mat, cm_mat):
+            if mat is not None:
+                minmax_normalize_cols(mat, out=mat)
+
+    # line styles built once, outside the trace loops
+    eeg_lines = [dict(width=0.8, color=EEG_COLORS[i % len(EEG_COLORS)]) for i in range(len(eeg_channels))]
+    ecg_lines = [dict(width=1, color=ECG_COLORS[i % len(ECG_COLORS)]) for i in range(len(ecg_channels))]
 
     # EEG (µV) on primary y of row 1
     for i,ch in enumerate(eeg_channels):
-        y = df[ch]
-        if normalize:
-            y = minmax_normalize(y)
-            name = f"{ch} (norm)"
-        else:
-            name = ch
-        fig.add_trace(
-            go.Scatter(x=time, y=y, mode="lines", name=name, line=dict(width=0.8, color=EEG_COLORS[i % len(EEG_COLORS)]), opacity=0.6),
+        y = eeg_mat[:, i]
+        name = f"{ch} (norm)" if normalize else ch
+        add_line(
+            fig, time, y,
+            go.Scattergl(mode="lines", name=name, line=eeg_lines[i], opacity=0.6),
             row=1, col=1, secondary_y=False
         )
 
-    # ECG (mV) -> convert to µV and put on secondary y of row 1
+    # ECG (µV) on secondary y of row 1
     for i,ch in enumerate(ecg_channels):
-        y = df[ch] * 1000.0
-        if normalize:
-            y = minmax_normalize(y)
-            name = f"{ch} (norm)"
-        else:
-            name = f"{ch} (µV)"
-        fig.add_trace(
-            go.Scatter(x=time, y=y, mode="lines", name=name, line=dict(width=1, color=ECG_COLORS[i % len(ECG_COLORS)]), opacity=0.9),
+        y = ecg_mat[:, i]
+        name = f"{ch} (norm)" if normalize else f"{ch} (µV)"
+        add_line(
+            fig, time, y,
+            go.Scattergl(mode="lines", name=name, line=ecg_lines[i], opacity=0.9),
             row=1, col=1, secondary_y=True
         )
 
     # CM in row 2
     if cm_channel is not None:
-        y = df[cm_channel]
-        if normalize:
-            y = minmax_normalize(y)
-            name = f"{cm_channel} (norm)"
-        else:
-            name = cm_channel
-        fig.add_trace(
-            go.Scatter(x=time, y=y, mode="lines", name=name, line=dict(width=1, color=CM_COLOR), opacity=0.8),
+        y = cm_mat[:, 0]
+        name = f"{cm_channel} (norm)" if normalize else cm_channel
+        add_line(
+            fig, time, y,
+            go.Scattergl(mode="lines", name=name, line=dict(width=1, color=CM_COLOR), opacity=0.8),
             row=2, col=1
         )
 
@@ -175,8 +370,9 @@ def build_figure(df, eeg_channels, ecg_channels, cm_channel, normalize):
         margin=dict(l=70, r=70, t=60, b=60)
     )
 
-    # Put range slider on the bottom x-axis only
-    fig.update_xaxes(title_text="Time (s)", row=2, col=1, rangeslider=dict(visible=True))
+    # Put range slider on the bottom x-axis only (skipped for long recordings)
+    fig.update_xaxes(title_text="Time (s)", row=2, col=1,
+                     rangeslider=dict(visible=len(df) <= RANGESLIDER_MAX_SAMPLES))
 
     # Axis titles
     fig.update_yaxes(title_text="EEG (µV)" if not normalize else "EEG (normalized)", 
@@ -197,13 +393,9 @@ def main():
         print(f"CSV not found: {csv_path}", file=sys.stderr)
         sys.exit(1)
 
+    # ignored columns are never parsed (see pick_usecols)
     df = load_data(str(csv_path), args.downsample)
 
-    # Drop ignored columns if present
-    drop_cols = [c for c in df.columns if is_ignored_column(c)]
-    if drop_cols:
-        df = df.drop(columns=drop_cols, errors="ignore")
-
     eeg_channels, ecg_channels, cm_channel = detect_channels(
         df,
         include_ecg=not args.no_ecg,
@@ -215,13 +407,34 @@ def main():
         print("Columns found:", list(df.columns), file=sys.stderr)
         sys.exit(2)
 
+    if args.lttb_points:
+        if MinMaxLTTBDownsampler is None:
+            print("--lttb-points requires tsdownsample (pip install tsdownsample).", file=sys.stderr)
+            sys.exit(1)
+        channels = eeg_channels + ecg_channels + ([cm_channel] if cm_channel is not None else [])
+        df = lttb_downsample(df, channels, args.lttb_points)
+
     fig = build_figure(df, eeg_channels, ecg_channels, cm_channel, normalize=args.normalize)
 
-    # Save HTML if requested
+    # Save HTML if requested (with plotly-resampler this holds the aggregated samples only)
     if args.html_out:
         out = Path(args.html_out)
-        fig.write_html(str(out), include_plotlyjs="cdn", full_html=True)
-        print(f"Saved interactive HTML to: {out.resolve()}" )
+        html = fig.to_html(include_plotlyjs="cdn", full_html=True, div_id="eegplot",
+                           include_mathjax=False, auto_play=False, config={"scrollZoom": True})
+        out.write_text(html, encoding="utf-8")
+        # gzipped copy for hosting (servers can send it as Content-Encoding: gzip)
+        out_gz = out.with_suffix(out.suffix + ".gz")
+        with gzip.open(out_gz, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(html)
+        print(f"Saved interactive HTML to: {out.resolve()} (+ {out_gz.name})" )
+
+    if args.dash:
+        if FigureResampler is None or not isinstance(fig, FigureResampler):
+            print("--dash requires plotly-resampler (pip install plotly-resampler).", file=sys.stderr)
+            sys.exit(1)
+        # local Dash app so zoom/pan re-aggregates from the full-resolution series; prints its URL
+        fig.show_dash(mode="external")
+        return
 
     try:
         fig.show()